@@ -1,16 +1,41 @@
 from fastapi import FastAPI, HTTPException, Body
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.responses import ORJSONResponse
+from pydantic import BaseModel, ConfigDict
 import httpx
-import json
+import orjson
 import os
 import uuid
 import logging
 import asyncio
-from typing import List, Dict, Optional, Set
-
-app = FastAPI(title="LLM Conversation Orchestrator")
-logging.basicConfig(level=logging.INFO)
+from collections import OrderedDict
+import functools
+import hashlib
+import itertools
+import time
+import weakref
+from contextlib import aclosing, asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, List, Dict, Optional, Set, Tuple
+
+# Shared HTTP client for Ollama, kept open for the lifetime of the app
+http_client: Optional[httpx.AsyncClient] = None
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Create the shared HTTP client on startup and close it on shutdown"""
+    global http_client
+    http_client = httpx.AsyncClient(
+        base_url=OLLAMA_API_URL,
+        http2=OLLAMA_HTTP2,
+        # Generations can take minutes, but a connection that can't be opened should fail fast
+        timeout=httpx.Timeout(1800.0, connect=5.0),
+        limits=httpx.Limits(max_connections=100, max_keepalive_connections=20, keepalive_expiry=300),
+    )
+    yield
+    await http_client.aclose()
+
+app = FastAPI(title="LLM Conversation Orchestrator", default_response_class=ORJSONResponse, lifespan=lifespan)
+logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO").upper())
 logger = logging.getLogger(__name__)
 
 # Add CORS middleware
@@ -29,6 +54,10 @@ CHARACTERS_DIR = os.environ.get("CHARACTERS_DIR", "./characters")
 CONVERSATIONS_DIR = os.environ.get("CONVERSATIONS_DIR", "./conversations")
 CONFIG_DIR = os.environ.get("CONFIG_DIR", "./config")
 CONFIG_FILE = os.path.join(CONFIG_DIR, "system_config.json")
+# Maximum number of generate requests sent to Ollama at the same time
+OLLAMA_NUM_PARALLEL = int(os.environ.get("OLLAMA_NUM_PARALLEL", "4"))
+# Negotiate HTTP/2 with Ollama when it is served over TLS (e.g. behind a reverse proxy)
+OLLAMA_HTTP2 = os.environ.get("OLLAMA_HTTP2", "true").lower() in ("1", "true", "yes")
 
 # Create directories if they don't exist
 os.makedirs(CHARACTERS_DIR, exist_ok=True)
@@ -38,9 +67,23 @@ os.makedirs(CONFIG_DIR, exist_ok=True)
 # Log the Ollama API URL at startup
 logger.info(f"Using Ollama API URL: {OLLAMA_API_URL}")
 
-# Track model loading status
+# Track model loading status; plain dict assignments from the event loop need no lock
 model_loading_status = {}
-model_loading_lock = asyncio.Lock()
+
+# Limit concurrent generate requests to what Ollama can serve in parallel
+ollama_semaphore = asyncio.Semaphore(OLLAMA_NUM_PARALLEL)
+
+# Generations currently running, keyed by a hash of the request
+inflight_generations: Dict[str, asyncio.Task] = {}
+
+# Model loads currently running, keyed by model name
+inflight_model_loads: Dict[str, asyncio.Task] = {}
+
+# Ollama's model list, with the time.monotonic() it was fetched at, so status polling
+# doesn't hit Ollama on every request
+OLLAMA_MODELS_TTL = 2.0
+ollama_models_cache: Optional[Tuple[float, List[Dict]]] = None
+inflight_model_lists: Dict[str, asyncio.Task] = {}
 
 # System configuration with defaults
 DEFAULT_SYSTEM_CONFIG = {
@@ -49,6 +92,33 @@ DEFAULT_SYSTEM_CONFIG = {
     "max_tokens": 1024
 }
 
+# Tags around the thinking blocks emitted by reasoning models
+THINK_OPEN_TAG = "<think>"
+THINK_CLOSE_TAG = "</think>"
+
+# Number of most recent messages included in the prompt
+HISTORY_LENGTH = 20
+
+# Quote characters the model sometimes wraps a whole reply in
+QUOTE_CHARS = ('"', "'")
+
+# System prompt given to every character; filled in per character and cast
+SYSTEM_PROMPT_TEMPLATE = """
+        あなたは{name}というキャラクターです。
+        {system_prompt}
+        
+        あなたは{other_characters}との会話に参加しています。
+        自然な会話の中で、あなたのキャラクターとして応答してください。
+        
+        重要なルール：
+        1. 必ずあなたのキャラクターとして短い返答をしてください。
+        2. <think>タグや思考プロセスは含めないでください。
+        3. 引用符（"）は使わないでください。
+        4. キャラクター名を返信の前に付けないでください。
+        5. 他のキャラクターとの自然な会話をしましょう。
+        6. 同じ話題が続いたときは自然に話題を変えましょう。誰かが話題を変えたら、それについて行きましょう。
+        """
+
 # Models
 class Character(BaseModel):
     name: str
@@ -80,30 +150,237 @@ class SystemConfig(BaseModel):
     max_tokens: int = 1024
 
 class ModelLoadRequest(BaseModel):
+    # Allow the "model_" field name, which Pydantic v2 reserves by default
+    model_config = ConfigDict(protected_namespaces=())
+    
     model_name: str
 
+# Parsed system config, with the file mtime it was read at
+system_config_cache: Optional[Tuple[int, SystemConfig]] = None
+
+# Recently used conversations by file path, with the file mtime they were read at
+CONVERSATION_CACHE_SIZE = 32
+conversation_cache: OrderedDict[str, Tuple[int, Conversation]] = OrderedDict()
+
+# Serializes continuations of the same conversation; a lock is dropped once no request holds or waits for it
+conversation_locks: weakref.WeakValueDictionary[str, asyncio.Lock] = weakref.WeakValueDictionary()
+
+# File names per directory, with the directory mtime they were listed at
+directory_index: Dict[str, Tuple[int, List[str]]] = {}
+
 # Helper functions
+def write_file(path: str, data: bytes):
+    """Write bytes to a file atomically, so readers never see a partially written file"""
+    temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    try:
+        with open(temp_path, "wb") as f:
+            f.write(data)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
 def load_system_config() -> SystemConfig:
     """Load system configuration from file or create default if it doesn't exist"""
-    if not os.path.exists(CONFIG_FILE):
-        with open(CONFIG_FILE, "w") as f:
-            json.dump(DEFAULT_SYSTEM_CONFIG, f, indent=2)
-        return SystemConfig(**DEFAULT_SYSTEM_CONFIG)
+    global system_config_cache
+    try:
+        mtime = os.stat(CONFIG_FILE).st_mtime_ns
+    except FileNotFoundError:
+        config = SystemConfig(**DEFAULT_SYSTEM_CONFIG)
+        save_system_config(config)
+        return config
+    
+    # Re-read the file only when it has changed
+    if system_config_cache is not None and system_config_cache[0] == mtime:
+        return system_config_cache[1]
     
-    with open(CONFIG_FILE, "r") as f:
-        return SystemConfig(**json.load(f))
+    with open(CONFIG_FILE, "rb") as f:
+        config = SystemConfig.model_validate_json(f.read())
+    system_config_cache = (mtime, config)
+    return config
 
 def save_system_config(config: SystemConfig):
     """Save system configuration to file"""
-    with open(CONFIG_FILE, "w") as f:
-        json.dump(config.dict(), f, indent=2)
+    global system_config_cache
+    write_file(CONFIG_FILE, orjson.dumps(config.model_dump(), option=orjson.OPT_INDENT_2))
+    system_config_cache = (os.stat(CONFIG_FILE).st_mtime_ns, config)
+
+@functools.lru_cache(maxsize=256)
+def read_character(name: str, mtime: int) -> Character:
+    """Parse a character file; cached per file modification time"""
+    character_path = os.path.join(CHARACTERS_DIR, f"{name}.json")
+    with open(character_path, "rb") as f:
+        return Character.model_validate_json(f.read())
+
+def load_character(name: str) -> Character:
+    """Load a character definition, re-reading the file only when it has changed"""
+    character_path = os.path.join(CHARACTERS_DIR, f"{name}.json")
+    return read_character(name, os.stat(character_path).st_mtime_ns)
+
+def list_file_names(directory: str, suffixes: Tuple[str, ...] = (".json",)) -> List[str]:
+    """List the names of the files with the given suffixes in a directory, rescanning only when it has changed"""
+    mtime = os.stat(directory).st_mtime_ns
+    cached = directory_index.get(directory)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+    
+    with os.scandir(directory) as entries:
+        names = [os.path.splitext(entry.name)[0] for entry in entries if entry.name.endswith(suffixes) and entry.is_file()]
+    names = list(dict.fromkeys(names))
+    directory_index[directory] = (mtime, names)
+    return names
+
+def find_conversation_file(conversation_id: str) -> Optional[str]:
+    """Return the path a conversation is stored at, or None if it doesn't exist"""
+    # Conversations are stored as JSON Lines; .json files are from before the switch
+    for suffix in (".jsonl", ".json"):
+        conversation_path = os.path.join(CONVERSATIONS_DIR, f"{conversation_id}{suffix}")
+        if os.path.exists(conversation_path):
+            return conversation_path
+    return None
+
+def read_conversation(conversation_path: str) -> Conversation:
+    """Load a conversation from a JSON Lines file or an old single JSON document"""
+    # Conversation files are only written by this app, so skip validation when loading them
+    with open(conversation_path, "rb") as f:
+        if conversation_path.endswith(".json"):
+            data = orjson.loads(f.read())
+            raw_messages = data.pop("messages", [])
+        else:
+            data = orjson.loads(f.readline())
+            raw_messages = [orjson.loads(line) for line in f if line.strip()]
+    messages = [Message.model_construct(**message) for message in raw_messages]
+    return Conversation.model_construct(**data, messages=messages)
+
+def write_conversation(conversation: Conversation):
+    """Write a whole conversation as JSON Lines: a header line, then one line per message"""
+    lines = [orjson.dumps({"id": conversation.id, "characters": conversation.characters})]
+    lines.extend(orjson.dumps(message.model_dump()) for message in conversation.messages)
+    write_file(os.path.join(CONVERSATIONS_DIR, f"{conversation.id}.jsonl"), b"\n".join(lines) + b"\n")
+
+def append_messages(conversation_id: str, messages: List[Message]):
+    """Append messages to a conversation's JSON Lines file"""
+    conversation_path = os.path.join(CONVERSATIONS_DIR, f"{conversation_id}.jsonl")
+    with open(conversation_path, "ab") as f:
+        f.write(b"".join(orjson.dumps(message.model_dump()) + b"\n" for message in messages))
+
+def remember_conversation(conversation_path: str, mtime: int, conversation: Conversation):
+    """Cache a conversation, evicting the least recently used one when the cache is full"""
+    conversation_cache[conversation_path] = (mtime, conversation)
+    conversation_cache.move_to_end(conversation_path)
+    while len(conversation_cache) > CONVERSATION_CACHE_SIZE:
+        conversation_cache.popitem(last=False)
+
+async def load_conversation(conversation_path: str) -> Conversation:
+    """Load a conversation, reusing the cached copy while its file is unchanged"""
+    mtime = (await asyncio.to_thread(os.stat, conversation_path)).st_mtime_ns
+    cached = conversation_cache.get(conversation_path)
+    if cached is not None and cached[0] == mtime:
+        conversation_cache.move_to_end(conversation_path)
+        return cached[1]
+    
+    conversation = await asyncio.to_thread(read_conversation, conversation_path)
+    remember_conversation(conversation_path, mtime, conversation)
+    return conversation
+
+async def save_conversation(conversation: Conversation, new_messages: Optional[List[Message]] = None):
+    """Write a conversation, or append only new_messages if given, and cache the result"""
+    conversation_path = os.path.join(CONVERSATIONS_DIR, f"{conversation.id}.jsonl")
+    if new_messages is None:
+        await asyncio.to_thread(write_conversation, conversation)
+    else:
+        await asyncio.to_thread(append_messages, conversation.id, new_messages)
+    mtime = (await asyncio.to_thread(os.stat, conversation_path)).st_mtime_ns
+    remember_conversation(conversation_path, mtime, conversation)
+
+async def load_characters(names: List[str]) -> Dict[str, Character]:
+    """Load the given characters concurrently, keyed by name, reporting every missing one"""
+    unique_names = list(dict.fromkeys(names))
+    results = await asyncio.gather(
+        *[asyncio.to_thread(load_character, name) for name in unique_names],
+        return_exceptions=True
+    )
+    missing_characters = [name for name, result in zip(unique_names, results) if isinstance(result, FileNotFoundError)]
+    if len(missing_characters) == 1:
+        raise HTTPException(status_code=404, detail=f"Character {missing_characters[0]} not found")
+    if missing_characters:
+        raise HTTPException(status_code=404, detail=f"Characters {', '.join(missing_characters)} not found")
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+    return dict(zip(unique_names, results))
+
+def start_once(inflight: Dict[str, asyncio.Task], key: str, factory: Callable[[], Awaitable[Any]]) -> asyncio.Task:
+    """Start factory() as a task unless one for the same key is still running, and return the task"""
+    task = inflight.get(key)
+    # A finished task stays in the map until its done callback runs on a later loop step
+    if task is None or task.done():
+        task = asyncio.create_task(factory())
+        inflight[key] = task
+        task.add_done_callback(lambda done: inflight.pop(key) if inflight.get(key) is done else None)
+    return task
+
+async def coalesce(inflight: Dict[str, asyncio.Task], key: str, factory: Callable[[], Awaitable[Any]]) -> Any:
+    """Run factory() once for concurrent callers with the same key and share its result"""
+    # Shield the shared task so one caller being cancelled doesn't cancel it for the others
+    return await asyncio.shield(start_once(inflight, key, factory))
+
+@functools.lru_cache(maxsize=256)
+def name_prefixes(characters: Tuple[str, ...]) -> Tuple[str, ...]:
+    """Return the "name:" prefixes a model may put before a reply, cached per cast"""
+    return tuple(f"{c}:" for c in characters)
+
+def strip_wrapping_quotes(text: str) -> str:
+    """Remove quotes wrapping the whole text"""
+    # Comparing one-character slices avoids scanning the text
+    if text[:1] in QUOTE_CHARS and text[:1] == text[-1:]:
+        return text[1:-1].strip()
+    return text
+
+def strip_think_blocks(text: str) -> str:
+    """Remove <think>...</think> blocks from text, leaving an unclosed block as it is"""
+    # str.find scans in C; this is several times faster than a lazy .*? regex over long blocks
+    start = text.find(THINK_OPEN_TAG)
+    if start < 0:
+        return text
+    
+    kept = []
+    position = 0
+    while start >= 0:
+        end = text.find(THINK_CLOSE_TAG, start + len(THINK_OPEN_TAG))
+        if end < 0:
+            break
+        kept.append(text[position:start])
+        position = end + len(THINK_CLOSE_TAG)
+        start = text.find(THINK_OPEN_TAG, position)
+    kept.append(text[position:])
+    return "".join(kept)
+
+def clean_message(content: str) -> str:
+    """Remove <think> blocks, surrounding whitespace and wrapping quotes from a message"""
+    return strip_wrapping_quotes(strip_think_blocks(content).strip())
+
+def build_system_prompt(character_name: str, character: Character, characters: List[str]) -> str:
+    """Build the system prompt for a character"""
+    return format_system_prompt(character_name, character.name, character.system_prompt, tuple(characters))
+
+@functools.lru_cache(maxsize=256)
+def format_system_prompt(character_name: str, name: str, system_prompt: str, characters: Tuple[str, ...]) -> str:
+    """Format the system prompt template, cached per character definition and cast"""
+    return SYSTEM_PROMPT_TEMPLATE.format(
+        name=name,
+        system_prompt=system_prompt,
+        other_characters=", ".join(c for c in characters if c != character_name)
+    )
 
 # API Endpoints
 @app.get("/system/config", response_model=SystemConfig)
 async def get_system_config():
     """Get system configuration"""
     try:
-        return load_system_config()
+        config = await asyncio.to_thread(load_system_config)
+        return ORJSONResponse(config.model_dump())
     except Exception as e:
         logger.error(f"Error loading system config: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -112,8 +389,8 @@ async def get_system_config():
 async def update_system_config(config: SystemConfig):
     """Update system configuration"""
     try:
-        save_system_config(config)
-        return config
+        await asyncio.to_thread(save_system_config, config)
+        return ORJSONResponse(config.model_dump())
     except Exception as e:
         logger.error(f"Error updating system config: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -122,16 +399,12 @@ async def update_system_config(config: SystemConfig):
 async def list_available_models():
     """List all available models from Ollama"""
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(f"{OLLAMA_API_URL}/tags")
-            models = response.json().get("models", [])
-            
-            # Add loading status information
-            for model in models:
-                model_name = model.get("name")
-                model["loading"] = model_loading_status.get(model_name, False)
-                
-            return models
+        models = await get_ollama_models()
+        
+        # Add loading status information, copying so the cached list stays unchanged
+        models = [{**model, "loading": model_loading_status.get(model.get("name"), False)} for model in models]
+        
+        return ORJSONResponse(models)
     except Exception as e:
         logger.error(f"Error listing models: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -143,18 +416,16 @@ async def load_model(request: ModelLoadRequest):
     
     try:
         # Set loading status
-        async with model_loading_lock:
-            model_loading_status[model_name] = True
+        model_loading_status[model_name] = True
         
-        # Start loading the model (non-blocking)
-        asyncio.create_task(perform_model_loading(model_name))
+        # Start loading the model (non-blocking), joining a load of the same model already running
+        start_once(inflight_model_loads, model_name, lambda: perform_model_loading(model_name))
         
         return {"status": "loading", "model": model_name}
     except Exception as e:
         logger.error(f"Error initiating model loading: {e}")
         # Reset loading status on error
-        async with model_loading_lock:
-            model_loading_status[model_name] = False
+        model_loading_status[model_name] = False
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/system/models/status", response_model=Dict[str, bool])
@@ -166,7 +437,8 @@ async def get_model_loading_status():
 async def list_characters():
     """List all available characters"""
     try:
-        return [f.replace(".json", "") for f in os.listdir(CHARACTERS_DIR) if f.endswith(".json")]
+        names = await asyncio.to_thread(list_file_names, CHARACTERS_DIR)
+        return ORJSONResponse(names)
     except Exception as e:
         logger.error(f"Error listing characters: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -177,13 +449,13 @@ async def create_character(character: CharacterCreationRequest):
     try:
         # Check if character already exists
         character_path = os.path.join(CHARACTERS_DIR, f"{character.name}.json")
-        if os.path.exists(character_path):
+        if await asyncio.to_thread(os.path.exists, character_path):
             raise HTTPException(status_code=400, detail=f"Character {character.name} already exists")
         
         # Create character file (using only personality traits, no model information)
-        character_data = character.dict()
-        with open(character_path, "w") as f:
-            json.dump(character_data, f, indent=2)
+        character_data = character.model_dump()
+        await asyncio.to_thread(write_file, character_path, orjson.dumps(character_data, option=orjson.OPT_INDENT_2))
+        read_character.cache_clear()
         
         return {"status": "success", "message": f"Character {character.name} created"}
     except HTTPException:
@@ -196,12 +468,12 @@ async def create_character(character: CharacterCreationRequest):
 async def get_character(name: str):
     """Get character details"""
     try:
-        character_path = os.path.join(CHARACTERS_DIR, f"{name}.json")
-        if not os.path.exists(character_path):
+        # load_character stats the file anyway, so a missing file surfaces here
+        try:
+            character = await asyncio.to_thread(load_character, name)
+        except FileNotFoundError:
             raise HTTPException(status_code=404, detail=f"Character {name} not found")
-        
-        with open(character_path, "r") as f:
-            return json.load(f)
+        return ORJSONResponse(character.model_dump())
     except HTTPException:
         raise
     except Exception as e:
@@ -212,11 +484,8 @@ async def get_character(name: str):
 async def create_conversation(request: ConversationRequest):
     """Start a new conversation between characters"""
     try:
-        # Check if all characters exist
-        for character_name in request.characters:
-            character_path = os.path.join(CHARACTERS_DIR, f"{character_name}.json")
-            if not os.path.exists(character_path):
-                raise HTTPException(status_code=404, detail=f"Character {character_name} not found")
+        # Load all characters once up front instead of on every turn
+        characters = await load_characters(request.characters)
         
         # Create conversation
         conversation_id = str(uuid.uuid4())
@@ -240,7 +509,9 @@ async def create_conversation(request: ConversationRequest):
                 current_character_index = 0
             
             current_character = request.characters[current_character_index]
-            response_content = await generate_response(conversation, current_character)
+            response_content = await generate_response(
+                conversation, current_character, characters[current_character]
+            )
             
             conversation.messages.append(
                 Message(role=current_character, content=response_content)
@@ -249,11 +520,9 @@ async def create_conversation(request: ConversationRequest):
             current_character_index += 1
         
         # Save conversation
-        conversation_path = os.path.join(CONVERSATIONS_DIR, f"{conversation_id}.json")
-        with open(conversation_path, "w") as f:
-            f.write(conversation.json())
+        await save_conversation(conversation)
         
-        return conversation
+        return ORJSONResponse(conversation.model_dump())
     except HTTPException:
         raise
     except Exception as e:
@@ -264,7 +533,8 @@ async def create_conversation(request: ConversationRequest):
 async def list_conversations():
     """List all conversations"""
     try:
-        return [f.replace(".json", "") for f in os.listdir(CONVERSATIONS_DIR) if f.endswith(".json")]
+        names = await asyncio.to_thread(list_file_names, CONVERSATIONS_DIR, (".jsonl", ".json"))
+        return ORJSONResponse(names)
     except Exception as e:
         logger.error(f"Error listing conversations: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -273,12 +543,12 @@ async def list_conversations():
 async def get_conversation(conversation_id: str):
     """Get a specific conversation"""
     try:
-        conversation_path = os.path.join(CONVERSATIONS_DIR, f"{conversation_id}.json")
-        if not os.path.exists(conversation_path):
+        conversation_path = await asyncio.to_thread(find_conversation_file, conversation_id)
+        if conversation_path is None:
             raise HTTPException(status_code=404, detail=f"Conversation {conversation_id} not found")
         
-        with open(conversation_path, "r") as f:
-            return json.loads(f.read())
+        conversation = await load_conversation(conversation_path)
+        return ORJSONResponse(conversation.model_dump())
     except HTTPException:
         raise
     except Exception as e:
@@ -289,222 +559,290 @@ async def get_conversation(conversation_id: str):
 async def continue_conversation(conversation_id: str, num_turns: int = Body(1, embed=True)):
     """Continue an existing conversation for additional turns"""
     try:
-        conversation_path = os.path.join(CONVERSATIONS_DIR, f"{conversation_id}.json")
-        if not os.path.exists(conversation_path):
+        # Only create a lock for a conversation that exists, so unknown ids don't add entries
+        conversation_path = await asyncio.to_thread(find_conversation_file, conversation_id)
+        if conversation_path is None:
             raise HTTPException(status_code=404, detail=f"Conversation {conversation_id} not found")
         
-        # Load conversation
-        with open(conversation_path, "r") as f:
-            conversation = Conversation(**json.loads(f.read()))
-        
-        # Find last character index
-        last_character = conversation.messages[-1].role
-        if last_character == "system":
-            current_character_index = 0
-        else:
-            current_character_index = conversation.characters.index(last_character)
-            current_character_index = (current_character_index + 1) % len(conversation.characters)
-        
-        # Generate conversation turns
-        for _ in range(num_turns):
-            current_character = conversation.characters[current_character_index]
-            response_content = await generate_response(conversation, current_character)
-            
-            conversation.messages.append(
-                Message(role=current_character, content=response_content)
-            )
-            
-            current_character_index = (current_character_index + 1) % len(conversation.characters)
-        
-        # Save updated conversation
-        with open(conversation_path, "w") as f:
-            f.write(conversation.json())
-        
-        return conversation
+        lock = conversation_locks.get(conversation_id)
+        if lock is None:
+            lock = conversation_locks[conversation_id] = asyncio.Lock()
+        async with lock:
+            return await continue_conversation_locked(conversation_id, num_turns)
     except HTTPException:
         raise
     except Exception as e:
         logger.error(f"Error continuing conversation: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+async def continue_conversation_locked(conversation_id: str, num_turns: int):
+    """Continue a conversation while holding its lock"""
+    conversation_path = await asyncio.to_thread(find_conversation_file, conversation_id)
+    if conversation_path is None:
+        raise HTTPException(status_code=404, detail=f"Conversation {conversation_id} not found")
+    
+    # Load conversation, copying the message list so the cached copy isn't changed
+    # until the new turns have been saved
+    conversation = await load_conversation(conversation_path)
+    conversation = conversation.model_copy(update={"messages": list(conversation.messages)})
+    num_saved_messages = len(conversation.messages)
+    
+    characters = await load_characters(conversation.characters)
+    
+    # Continue with the character after the last speaker (the first one after a system message)
+    character_indexes = {name: i for i, name in enumerate(conversation.characters)}
+    last_character = conversation.messages[-1].role
+    current_character_index = (character_indexes.get(last_character, -1) + 1) % len(conversation.characters)
+    
+    # Generate conversation turns
+    for _ in range(num_turns):
+        current_character = conversation.characters[current_character_index]
+        response_content = await generate_response(
+            conversation, current_character, characters[current_character]
+        )
+        
+        conversation.messages.append(
+            Message(role=current_character, content=response_content)
+        )
+        
+        current_character_index = (current_character_index + 1) % len(conversation.characters)
+    
+    # Save updated conversation, appending only the new messages
+    if conversation_path.endswith(".jsonl"):
+        await save_conversation(conversation, conversation.messages[num_saved_messages:])
+    else:
+        # Convert a conversation saved as a single JSON document
+        await save_conversation(conversation)
+        await asyncio.to_thread(os.remove, conversation_path)
+        conversation_cache.pop(conversation_path, None)
+    
+    return ORJSONResponse(conversation.model_dump())
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
     try:
         # Check if we can connect to Ollama
-        async with httpx.AsyncClient(timeout=5.0) as client:
-            response = await client.get(f"{OLLAMA_API_URL}/tags")
-            if response.status_code != 200:
-                return {"status": "unhealthy", "message": "Cannot connect to Ollama"}
-            
-            # Return available models
-            models = response.json().get("models", [])
-            model_names = [model.get("name") for model in models]
-            
-            return {
-                "status": "healthy",
-                "ollama_url": OLLAMA_API_URL,
-                "available_models": model_names,
-                "active_model": load_system_config().active_model
-            }
+        models = await get_ollama_models()
+        
+        # Return available models
+        model_names = [model.get("name") for model in models]
+        
+        return {
+            "status": "healthy",
+            "ollama_url": OLLAMA_API_URL,
+            "available_models": model_names,
+            "active_model": (await asyncio.to_thread(load_system_config)).active_model
+        }
     except Exception as e:
         logger.error(f"Health check failed: {e}")
         return {"status": "unhealthy", "message": str(e)}
 
+async def fetch_ollama_models() -> List[Dict]:
+    """Fetch the list of models from Ollama and cache it"""
+    global ollama_models_cache
+    response = await http_client.get("/tags", timeout=5.0)
+    if response.status_code != 200:
+        raise Exception("Cannot connect to Ollama")
+    
+    models = orjson.loads(response.content).get("models", [])
+    ollama_models_cache = (time.monotonic(), models)
+    return models
+
+async def get_ollama_models() -> List[Dict]:
+    """Get the list of models from Ollama, reusing a recently fetched list"""
+    if ollama_models_cache is not None and time.monotonic() - ollama_models_cache[0] < OLLAMA_MODELS_TTL:
+        return ollama_models_cache[1]
+    
+    # Concurrent pollers share one request
+    return await coalesce(inflight_model_lists, "tags", fetch_ollama_models)
+
 async def perform_model_loading(model_name: str):
     """Actually perform the model loading in background"""
     try:
         logger.info(f"Starting to load model: {model_name}")
         
-        # Use Ollama's generate endpoint with a minimal prompt to load the model
-        async with httpx.AsyncClient(timeout=1800.0) as client:
-            response = await client.post(
-                f"{OLLAMA_API_URL}/generate",
-                json={
-                    "model": model_name,
-                    "prompt": "Hello",
-                    "temperature": 0.7,
-                    "max_tokens": 10,
-                    "stream": False
-                }
-            )
-            
-            if response.status_code != 200:
-                logger.error(f"Error loading model {model_name}: {response.text}")
-                raise Exception(f"Error loading model: {response.text}")
-            
-            logger.info(f"Successfully loaded model: {model_name}")
-            
-            # Update system config with new model
-            config = load_system_config()
-            config.active_model = model_name
-            save_system_config(config)
-            
-            # Update loading status
-            async with model_loading_lock:
-                model_loading_status[model_name] = False
+        # Use Ollama's generate endpoint with a minimal prompt to load the model.
+        # Ollama only streams once the model is in memory, so stop at the first chunk.
+        async with aclosing(stream_generate({
+            "model": model_name,
+            "prompt": "Hello",
+            "temperature": 0.7,
+            "max_tokens": 10
+        })) as chunks:
+            async for _ in chunks:
+                break
+        
+        logger.info(f"Successfully loaded model: {model_name}")
+        
+        # Update system config with new model
+        # Copy rather than modify the cached config in place
+        config = (await asyncio.to_thread(load_system_config)).model_copy(update={"active_model": model_name})
+        await asyncio.to_thread(save_system_config, config)
+        
+        # Update loading status
+        model_loading_status[model_name] = False
     except Exception as e:
         logger.error(f"Error loading model {model_name}: {e}")
         # Update loading status on error
-        async with model_loading_lock:
-            model_loading_status[model_name] = False
+        model_loading_status[model_name] = False
 
-async def generate_response(conversation: Conversation, character_name: str) -> str:
+class ThinkTagFilter:
+    """Remove <think>...</think> blocks from text that arrives in chunks"""
+    OPEN_TAG = THINK_OPEN_TAG
+    CLOSE_TAG = THINK_CLOSE_TAG
+    
+    def __init__(self):
+        # Text outside a block that may be the start of an open tag
+        self.buffer = ""
+        self.in_think = False
+        # Text of the current block, kept only for an unclosed block in flush()
+        self.think_parts: List[str] = []
+        # End of the current block, long enough to find a close tag split across chunks
+        self.think_tail = ""
+    
+    def feed(self, chunk: str) -> str:
+        """Add a chunk and return the text that is known to be outside <think> blocks"""
+        output = []
+        text = chunk
+        while text:
+            if self.in_think:
+                # Only the new text and the tail need searching, so long blocks stay linear
+                search = self.think_tail + text
+                end = search.find(self.CLOSE_TAG)
+                if end < 0:
+                    self.think_parts.append(text)
+                    self.think_tail = search[-(len(self.CLOSE_TAG) - 1):]
+                    break
+                text = search[end + len(self.CLOSE_TAG):]
+                self.think_parts = []
+                self.think_tail = ""
+                self.in_think = False
+            else:
+                text = self.buffer + text
+                self.buffer = ""
+                start = text.find(self.OPEN_TAG)
+                if start < 0:
+                    # Hold back a trailing partial "<think" that the next chunk may complete
+                    keep = 0
+                    for size in range(min(len(self.OPEN_TAG) - 1, len(text)), 0, -1):
+                        if self.OPEN_TAG.startswith(text[-size:]):
+                            keep = size
+                            break
+                    output.append(text[:len(text) - keep])
+                    self.buffer = text[len(text) - keep:]
+                    break
+                output.append(text[:start])
+                text = text[start + len(self.OPEN_TAG):]
+                self.in_think = True
+        return "".join(output)
+    
+    def flush(self) -> str:
+        """Return the remaining text once the stream has ended"""
+        remaining = self.OPEN_TAG + "".join(self.think_parts) if self.in_think else self.buffer
+        self.buffer = ""
+        self.in_think = False
+        self.think_parts = []
+        self.think_tail = ""
+        return remaining
+
+async def stream_generate(payload: Dict) -> AsyncIterator[str]:
+    """Stream the generated text from Ollama's generate endpoint chunk by chunk"""
+    async with http_client.stream("POST", "/generate", json={**payload, "stream": True}) as response:
+        if response.status_code != 200:
+            await response.aread()
+            raise Exception(f"Error from Ollama: {response.text}")
+        
+        async for line in response.aiter_lines():
+            if not line:
+                continue
+            chunk = orjson.loads(line)
+            if "error" in chunk:
+                raise Exception(f"Error from Ollama: {chunk['error']}")
+            yield chunk.get("response", "")
+            if chunk.get("done"):
+                break
+
+async def generate_text(payload: Dict) -> str:
+    """Generate text with Ollama, removing <think> blocks as the text streams in"""
+    think_filter = ThinkTagFilter()
+    response_parts = []
+    async with ollama_semaphore:
+        async for chunk in stream_generate(payload):
+            response_parts.append(think_filter.feed(chunk))
+    response_parts.append(think_filter.flush())
+    return "".join(response_parts)
+
+async def generate_response(conversation: Conversation, character_name: str, character: Character) -> str:
     """Generate a response from a character"""
     try:
-        # Load character
-        character_path = os.path.join(CHARACTERS_DIR, f"{character_name}.json")
-        with open(character_path, "r") as f:
-            character = Character(**json.load(f))
-        
         # Load system config for model, temperature and max_tokens
-        system_config = load_system_config()
+        system_config = await asyncio.to_thread(load_system_config)
         
         # Create prompt for the model
-        other_characters = [c for c in conversation.characters if c != character_name]
-        system_prompt = f"""
-        あなたは{character.name}というキャラクターです。
-        {character.system_prompt}
-        
-        あなたは{', '.join(other_characters)}との会話に参加しています。
-        自然な会話の中で、あなたのキャラクターとして応答してください。
-        
-        重要なルール：
-        1. 必ずあなたのキャラクターとして短い返答をしてください。
-        2. <think>タグや思考プロセスは含めないでください。
-        3. 引用符（"）は使わないでください。
-        4. キャラクター名を返信の前に付けないでください。
-        5. 他のキャラクターとの自然な会話をしましょう。
-        6. 同じ話題が続いたときは自然に話題を変えましょう。誰かが話題を変えたら、それについて行きましょう。
-        """
+        system_prompt = build_system_prompt(character_name, character, conversation.characters)
         
         # Build a cleaner conversation history with names to make it more clear
-        prompt_text = f"# システム指示\n{system_prompt}\n\n# 会話履歴\n"
+        prompt_parts = [f"# システム指示\n{system_prompt}\n\n# 会話履歴\n"]
         
         # Add conversation history with clear naming
-        # use only the last some messages
-        for message in conversation.messages[-20:]:
-            if message.role == "system":
-                continue
-            
-            # Clean any thinking tags from previous messages
-            content = message.content
-            if "<think>" in content and "</think>" in content:
-                # Remove anything between <think> and </think> tags
-                parts = content.split("<think>")
-                for i in range(1, len(parts)):
-                    if "</think>" in parts[i]:
-                        think_end = parts[i].find("</think>") + len("</think>")
-                        parts[i] = parts[i][think_end:]
-                content = "".join(parts)
-            
-            # Remove quotes from content
-            if (content.startswith('"') and content.endswith('"')) or \
-               (content.startswith("'") and content.endswith("'")):
-                content = content[1:-1].strip()
+        # use only the last some non-system messages, walking back from the end
+        # so long conversations don't have to be scanned in full
+        recent_messages = list(itertools.islice(
+            (m for m in reversed(conversation.messages) if m.role != "system"), HISTORY_LENGTH
+        ))
+        for message in reversed(recent_messages):
+            # Clean any thinking tags and quotes from previous messages
+            content = clean_message(message.content)
             
             # Add to conversation history with character name
-            prompt_text += f"{message.role}: {content.strip()}\n\n"
+            prompt_parts.append(f"{message.role}: {content}\n\n")
         
         # Add the current prompt for the character
-        prompt_text += f"{character_name} (あなた): "
-        
-        # Log the processed prompt for debugging
-        logger.info(f"Prompt for {character_name} using model {system_config.active_model}:\n{prompt_text}")
-        
-        # Generate response using Ollama
-        async with httpx.AsyncClient(timeout=1800.0) as client:
-            response = await client.post(
-                f"{OLLAMA_API_URL}/generate",
-                json={
-                    "model": system_config.active_model,
-                    "prompt": prompt_text,
-                    "temperature": system_config.temperature,
-                    "max_tokens": system_config.max_tokens,
-                    "stream": False
-                }
-            )
-            
-            if response.status_code != 200:
-                logger.error(f"Error from Ollama: {response.text}")
-                raise HTTPException(status_code=500, detail="Error generating response from model")
-            
-            response_text = response.json().get("response", "")
-            
-            # Clean up response
-            response_text = response_text.strip()
-            
-            # Remove <think> tags and content between them if they appear
-            if "<think>" in response_text and "</think>" in response_text:
-                parts = response_text.split("<think>")
-                result = [parts[0]]  # Keep text before first <think>
-                for i in range(1, len(parts)):
-                    if "</think>" in parts[i]:
-                        think_end = parts[i].find("</think>") + len("</think>")
-                        result.append(parts[i][think_end:])  # Add text after </think>
-                    else:
-                        # No matching </think>, just keep the original part
-                        result.append(parts[i])
-                response_text = "".join(result)
-            
-            # Remove character name if the model prefixed it
-            for char_name in conversation.characters:
-                if response_text.startswith(f"{char_name}:"):
-                    response_text = response_text[len(char_name)+1:].strip()
-            
-            # Remove quotes if the model wrapped the response in quotes
-            if (response_text.startswith('"') and response_text.endswith('"')) or \
-               (response_text.startswith("'") and response_text.endswith("'")):
-                response_text = response_text[1:-1].strip()
-            
-            # Log the final processed response
-            logger.info(f"Response from {character_name} (raw): {response_text}")
-            
-            return response_text.strip()
+        prompt_parts.append(f"{character_name} (あなた): ")
+        prompt_text = "".join(prompt_parts)
+        
+        # Log the processed prompt for debugging (formatted only when DEBUG is enabled)
+        logger.debug("Prompt for %s using model %s:\n%s", character_name, system_config.active_model, prompt_text)
+        
+        # Generate response using Ollama; identical requests already in flight share one generation
+        payload = {
+            "model": system_config.active_model,
+            "prompt": prompt_text,
+            "temperature": system_config.temperature,
+            "max_tokens": system_config.max_tokens
+        }
+        request_key = hashlib.blake2b(orjson.dumps(payload), digest_size=16).hexdigest()
+        response_text = await coalesce(inflight_generations, request_key, lambda: generate_text(payload))
+        
+        # Clean up response
+        response_text = response_text.strip()
+        
+        # Remove character name if the model prefixed it
+        if response_text.startswith(name_prefixes(tuple(conversation.characters))):
+            response_text = response_text[response_text.index(":") + 1:].strip()
+        
+        # Remove quotes if the model wrapped the response in quotes
+        response_text = strip_wrapping_quotes(response_text)
+        
+        # Log the final processed response
+        logger.debug("Response from %s (raw): %s", character_name, response_text)
+        
+        return response_text.strip()
     except Exception as e:
         logger.error(f"Error generating response: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    # Each worker is a separate process with its own model loading status and caches,
+    # so more than one worker is opt-in through WEB_CONCURRENCY
+    uvicorn.run(
+        "app:app",
+        host="0.0.0.0",
+        port=8000,
+        workers=int(os.environ.get("WEB_CONCURRENCY", "1")),
+        # uvloop isn't available on Windows, so let uvicorn fall back to asyncio there
+        loop="auto",
+        http="httptools"
+    )